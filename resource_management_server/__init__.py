@@ -13,23 +13,73 @@
 # limitations under the License.
 """Create a Flask application for the resource management server."""
 
+import click
 from flask import Flask
+from flask.helpers import get_debug_flag
+from werkzeug.serving import is_running_from_reloader
 
+from .admission import register_admission_control
+from .changelog import change_log
+from .config import Config
 from .database import initialize_db
+from .database import restore_locks
 from .database import start_timeout_check
+from .logger import logger
+from .logger import setup_logging
+from .profiling import register_profiling
 from .routes import register_routes
 
 
-def create_app() -> Flask:
+def is_reloader_parent(use_reloader: bool | None = None) -> bool:
+    """Check if this process is the parent process of the Werkzeug reloader.
+
+    The parent only watches source files and restarts the child process, which serves requests.
+
+    Args:
+        use_reloader (bool | None): Whether the server is run with the reloader.
+            When None, it is taken from the options of `flask run`, if running under it.
+
+    Returns:
+        bool: True when this process is the reloader parent.
+    """
+    if is_running_from_reloader():
+        return False
+    if use_reloader is None:
+        ctx = click.get_current_context(silent=True)
+        if ctx is None or ctx.command.name != 'run':
+            return False
+        use_reloader = ctx.params.get('reload')
+        if use_reloader is None:
+            # `flask run` enables the reloader with debug mode unless told otherwise.
+            use_reloader = get_debug_flag()
+    return use_reloader
+
+
+def create_app(use_reloader: bool | None = None) -> Flask:
     """Create a Flask application.
 
+    Args:
+        use_reloader (bool | None): Whether the server is run with the reloader.
+            When None, it is taken from the options of `flask run`, if running under it.
+
     Returns:
         Flask: The created Flask application.
     """
     app = Flask(__name__)
-    print('Initializing database...')
+    setup_logging()
+    if is_reloader_parent(use_reloader):
+        # Leave the database, the change log and the timeout check to the child serving requests.
+        logger.info('Running as reloader parent, skipping database initialization.')
+        register_routes(app)
+        return app
+    if Config.CHANGE_LOG_ENABLED:
+        change_log.open(standby=Config.STANDBY)
+    logger.info('Initializing database...')
     initialize_db()
-    print('Database initialized.')
+    restore_locks()
+    logger.info('Database initialized.')
+    register_profiling(app)
+    register_admission_control(app)
     register_routes(app)
     start_timeout_check()
     return app
@@ -0,0 +1,208 @@
+# Copyright (c) 2024 SoftBank Corp.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Admission control for the resource management server.
+
+Every request has to take a token from the bucket of its robot, its fleet, its endpoint and a
+server wide bucket before it is validated. Status polls may not take the last tokens of the
+server wide bucket, which are kept for registrations and releases.
+"""
+
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Flask
+from flask import Response
+from flask import jsonify
+from flask import request
+
+from .config import Config
+from .logger import log_context
+from .logger import logger
+
+# Endpoints which must keep working under load. Any other endpoint is treated as a status poll.
+HIGH_PRIORITY_ENDPOINTS = frozenset(('registration_call', 'release_call', 'robot_status'))
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at a fixed rate."""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        """Add the tokens accumulated since the last update.
+
+        Args:
+            now (float): Current monotonic time in seconds.
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, reserve: float = 0.0) -> float:
+        """Get the time to wait until a token can be taken.
+
+        Args:
+            reserve (float): Number of tokens which must be left in the bucket after taking one.
+
+        Returns:
+            float: Seconds to wait, 0 when a token is available now.
+        """
+        missing = reserve + 1.0 - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate
+
+
+class AdmissionController:
+    """Rate limits requests per robot, per fleet, per endpoint and server wide.
+
+    A request is only admitted when every bucket it maps to has a token, in which case one token
+    is taken from each of them. Rejected requests take no token. At most `ADMISSION_MAX_BUCKETS`
+    buckets are kept, evicting the least recently used one first.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._buckets: OrderedDict[tuple[str, str], TokenBucket] = OrderedDict()
+        self._limits = {
+            'robot': Config.ADMISSION_ROBOT_LIMIT,
+            'fleet': Config.ADMISSION_FLEET_LIMIT,
+            'endpoint': Config.ADMISSION_ENDPOINT_LIMIT,
+            'global': Config.ADMISSION_GLOBAL_LIMIT,
+        }
+        self._low_priority_reserve = Config.ADMISSION_GLOBAL_LIMIT[1] * Config.ADMISSION_LOW_PRIORITY_RESERVE
+        self._fleet_pattern = re.compile(Config.ADMISSION_FLEET_PATTERN)
+        self.admitted = 0
+        self.rejected: dict[str, int] = {}
+
+    def fleet_of(self, robot_id: str) -> str:
+        """Get the fleet prefix of a robot ID.
+
+        Args:
+            robot_id (str): The robot ID.
+
+        Returns:
+            str: The matched prefix, or the whole robot ID when the pattern does not match.
+        """
+        match = self._fleet_pattern.match(robot_id)
+        return match.group(0) if match and match.group(0) else robot_id
+
+    def _bucket(self, scope: str, key: str, now: float) -> TokenBucket | None:
+        rate, burst = self._limits[scope]
+        if rate <= 0:
+            return None
+        bucket = self._buckets.get((scope, key))
+        if bucket is None:
+            while len(self._buckets) >= Config.ADMISSION_MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[(scope, key)] = TokenBucket(rate, burst, now)
+        else:
+            self._buckets.move_to_end((scope, key))
+            bucket.refill(now)
+        return bucket
+
+    def admit(self, endpoint: str, robot_id: str | None, client: str | None) -> tuple[float, str | None]:
+        """Try to admit a request.
+
+        Args:
+            endpoint (str): Name of the endpoint.
+            robot_id (str | None): Robot ID in the request, if any.
+            client (str | None): Address of the client, used as the fleet key when there is no robot ID.
+
+        Returns:
+            tuple[float, str | None]: Seconds to wait before retrying and the scope of the bucket
+                which rejected the request. (0.0, None) when the request is admitted.
+        """
+        now = time.monotonic()
+        high_priority = endpoint in HIGH_PRIORITY_ENDPOINTS
+        fleet = self.fleet_of(robot_id) if robot_id else f'client:{client}'
+        with self._lock:
+            checks = [
+                ('global', self._bucket('global', '', now), 0.0 if high_priority else self._low_priority_reserve),
+                ('endpoint', self._bucket('endpoint', endpoint, now), 0.0),
+                ('fleet', self._bucket('fleet', fleet, now), 0.0),
+            ]
+            if robot_id:
+                checks.append(('robot', self._bucket('robot', robot_id, now), 0.0))
+            for scope, bucket, reserve in checks:
+                if bucket is None:
+                    continue
+                wait = bucket.wait_time(reserve)
+                if wait > 0:
+                    self.rejected[scope] = self.rejected.get(scope, 0) + 1
+                    return wait, scope
+            for _, bucket, _ in checks:
+                if bucket is not None:
+                    bucket.tokens -= 1.0
+            self.admitted += 1
+        return 0.0, None
+
+    def stats(self) -> dict[str, int | dict[str, int]]:
+        """Get counters of admitted and rejected requests.
+
+        Returns:
+            dict[str, int | dict[str, int]]: Number of admitted requests and rejected requests per scope.
+        """
+        with self._lock:
+            return {'admitted': self.admitted, 'rejected': dict(self.rejected)}
+
+
+def register_admission_control(app: Flask) -> AdmissionController | None:
+    """Check every API request against the admission controller before it reaches its route.
+
+    Args:
+        app (Flask): The Flask application.
+
+    Returns:
+        AdmissionController | None: The controller, or None when admission control is disabled.
+    """
+    if not Config.ADMISSION_ENABLED:
+        return None
+    controller = AdmissionController()
+    app.extensions['admission_control'] = controller
+
+    @app.before_request
+    def check_admission() -> Response | None:
+        """Reject the request with 429 when it exceeds the rate limits.
+
+        Returns:
+            Response | None: Rejection response, or None to continue handling the request.
+        """
+        if request.endpoint is None:
+            return None
+        payload = request.get_json(silent=True) if request.method == 'POST' else None
+        if not isinstance(payload, dict):
+            payload = None
+        robot_id = payload.get('robot_id') if payload else None
+        wait, scope = controller.admit(
+            request.endpoint, robot_id if isinstance(robot_id, str) else None, request.remote_addr)
+        if not wait:
+            return None
+        logger.warning(
+            'Request rejected by %s rate limit, retry after %.3f s.', scope, wait,
+            extra=log_context('admission', payload))
+        response = jsonify({'error': f'Too many requests ({scope} rate limit).', 'retry_after': round(wait, 3)})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(math.ceil(wait))
+        return response
+
+    return controller
@@ -15,7 +15,8 @@
 
 from resource_management_server import create_app
 
-app = create_app()
+# `app.run(debug=True)` below runs the reloader when this script is executed directly.
+app = create_app(use_reloader=True if __name__ == "__main__" else None)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+# Copyright (c) 2024 SoftBank Corp.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Cache of resource status responses.
+
+The status of a resource only changes on a registration, release, cancel or expiry, so the
+serialized response body is kept until one of them invalidates it, or until the expiration time
+of the lock it reports. Only changes made by this process invalidate the cache, so when
+`Config.STATUS_CACHE_TTL_MS` is set, every entry also expires after it to bound how long a change
+made by another process sharing the database is missed.
+"""
+
+import json
+import math
+import threading
+
+from .config import Config
+from .models import ResourceStatusPayload
+
+# Fields which differ between requests and are appended to the cached body on every response.
+PER_REQUEST_FIELDS = frozenset(('request_id', 'timestamp'))
+
+
+class StatusCache:
+    """Serialized ResourceStatusPayload bodies keyed by (bldg_id, resource_id).
+
+    Each key has a version which is bumped on invalidation. A body computed from a database read
+    is only stored if the version has not changed since before the read, so that a write racing
+    with the read cannot leave a stale body behind. Hit and miss counters are updated without
+    locking and may slightly undercount under concurrent requests.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: dict[tuple[str, str], tuple[bytes, float]] = {}
+        self._versions: dict[tuple[str, str], int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def version(self, bldg_id: str, resource_id: str) -> int:
+        """Get the current version of a key, to be passed to `put` after reading the database.
+
+        Args:
+            bldg_id (str): Building ID of the resource.
+            resource_id (str): ID of the resource.
+
+        Returns:
+            int: The version of the key.
+        """
+        return self._versions.get((bldg_id, resource_id), 0)
+
+    def get(self, bldg_id: str, resource_id: str, now: int) -> bytes | None:
+        """Get the cached body of a resource status.
+
+        Args:
+            bldg_id (str): Building ID of the resource.
+            resource_id (str): ID of the resource.
+            now (int): Current time in milliseconds.
+
+        Returns:
+            bytes | None: Body without the per request fields and the closing brace, None on a miss.
+        """
+        entry = self._entries.get((bldg_id, resource_id))
+        if entry is not None and now < entry[1]:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        return None
+
+    def put(
+            self, bldg_id: str, resource_id: str, payload: ResourceStatusPayload,
+            expires_at: int | None, version: int, now: int) -> bytes:
+        """Serialize a resource status and store it unless the key was invalidated meanwhile.
+
+        Statuses which are already stale are not stored. This is the case for an occupied resource
+        past the expiration time of its lock, which the timeout check only releases at the max
+        expiration time, so such a resource is read from the database on every request.
+
+        Args:
+            bldg_id (str): Building ID of the resource.
+            resource_id (str): ID of the resource.
+            payload (ResourceStatusPayload): The status to cache.
+            expires_at (int | None): Time in milliseconds at which the status becomes stale, if any.
+            version (int): Version of the key obtained before reading the database.
+            now (int): Current time in milliseconds.
+
+        Returns:
+            bytes: The serialized body, as returned by `get`.
+        """
+        data = {key: value for key, value in payload.model_dump().items() if key not in PER_REQUEST_FIELDS}
+        body = json.dumps(data, separators=(',', ':'), sort_keys=True)[:-1].encode()
+        key = (bldg_id, resource_id)
+        if Config.STATUS_CACHE_TTL_MS > 0:
+            max_expires_at = now + Config.STATUS_CACHE_TTL_MS
+            expires_at = max_expires_at if expires_at is None else min(expires_at, max_expires_at)
+        elif expires_at is None:
+            expires_at = math.inf
+        if expires_at <= now:
+            return body
+        with self._lock:
+            if self._versions.get(key, 0) == version:
+                self._entries[key] = (body, expires_at)
+        return body
+
+    def invalidate(self, bldg_id: str, resource_id: str) -> None:
+        """Drop the cached status of a resource after its lock state has changed.
+
+        Args:
+            bldg_id (str): Building ID of the resource.
+            resource_id (str): ID of the resource.
+        """
+        key = (bldg_id, resource_id)
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._entries.pop(key, None)
+            self.invalidations += 1
+
+    def stats(self) -> dict[str, int | float]:
+        """Get counters of the cache.
+
+        Returns:
+            dict[str, int | float]: Number of hits, misses, invalidations, entries and the hit rate.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'invalidations': self.invalidations,
+            'entries': len(self._entries),
+        }
+
+
+def render_status(body: bytes, request_id: str, timestamp: int) -> bytes:
+    """Complete a cached status body with the per request fields.
+
+    Args:
+        body (bytes): Body returned by `StatusCache.get` or `StatusCache.put`.
+        request_id (str): Request ID to echo back.
+        timestamp (int): Timestamp of the response.
+
+    Returns:
+        bytes: The complete JSON body.
+    """
+    return b'%s,"request_id":%s,"timestamp":%d}\n' % (body, json.dumps(request_id).encode(), timestamp)
+
+
+status_cache = StatusCache()
@@ -0,0 +1,283 @@
+# Copyright (c) 2024 SoftBank Corp.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Append-only log of resource lock state changes.
+
+Every grant, release, cancel and expiry is appended to the current log segment as a JSON line.
+A snapshot of all active locks is written periodically and a new segment is started after it,
+so the state can be rebuilt from the latest snapshot and the segments following it.
+
+Only the process holding the lock file writes the log. A standby process tails the log while
+waiting for the lock, and takes over as soon as the primary process exits.
+"""
+
+import fcntl
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from enum import Enum
+
+from .config import Config
+from .logger import logger
+
+SNAPSHOT_NAME = 'snapshot.json'
+LOCK_NAME = 'changelog.lock'
+SEGMENT_PREFIX = 'changes.'
+SEGMENT_SUFFIX = '.log'
+
+
+class ChangeEvent(str, Enum):
+    """Kind of state change recorded in the log."""
+    GRANT = 'grant'
+    RELEASE = 'release'
+    CANCEL = 'cancel'
+    EXPIRE = 'expire'
+
+
+def segment_name(first_seq: int) -> str:
+    """Get the file name of the segment starting at the given sequence number.
+
+    Args:
+        first_seq (int): Sequence number of the first record in the segment.
+
+    Returns:
+        str: File name of the segment.
+    """
+    return f'{SEGMENT_PREFIX}{first_seq:012d}{SEGMENT_SUFFIX}'
+
+
+class ChangeLog:
+    """Writer and reader of the change log directory.
+
+    `locks` always holds the state rebuilt from the log, keyed by (bldg_id, resource_id) with
+    (robot_id, locked_time, expiration_time) as value.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.locks: dict[tuple[str, str], tuple[str, int, int]] = {}
+        self.seq = 0
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._segment = None
+        self._records_since_snapshot = 0
+        # Read position of the segment being replayed or tailed.
+        self._read_segment: str | None = None
+        self._read_offset = 0
+
+    def open(self, standby: bool = False) -> None:
+        """Take ownership of the log and rebuild the state from it.
+
+        Exits the process when another process owns the log and `standby` is not set, since
+        both would serve from the same database while only one of them logs its changes.
+
+        Args:
+            standby (bool): Wait for the current owner to exit, tailing the log meanwhile.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = open(os.path.join(self.directory, LOCK_NAME), 'w')
+        self._load_snapshot()
+        self._tail()
+        if not self._try_lock():
+            if not standby:
+                logger.critical(
+                    'Change log in %s is owned by another server. Set RESOURCE_STANDBY=1 to run as standby.',
+                    self.directory)
+                sys.exit(1)
+            logger.info('Running as standby, tailing change log in %s.', self.directory)
+            while not self._try_lock():
+                time.sleep(Config.CHANGE_LOG_POLL_INTERVAL)
+                self._tail()
+            logger.info('Change log released by the primary, taking over.')
+        # Replay what the previous owner wrote after our last read.
+        self._tail()
+        with self._lock:
+            self._write_snapshot()
+        logger.info('Recovered %d active locks from change log up to #%d.', len(self.locks), self.seq)
+
+    def close(self) -> None:
+        """Close the current segment and release the ownership of the log."""
+        with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def commit(
+            self, conn: sqlite3.Connection, event: ChangeEvent, bldg_id: str, resource_id: str,
+            robot_id: str = '', locked_time: int = 0, expiration_time: int = 0) -> None:
+        """Commit a state change to the database and append it to the log.
+
+        Both happen under the same lock, so that the records are appended in the order the
+        transactions were committed, and nothing is appended when the commit fails. Only the
+        commit happens when this process does not own the log.
+
+        Args:
+            conn (sqlite3.Connection): Connection holding the uncommitted state change.
+            event (ChangeEvent): Kind of the state change.
+            bldg_id (str): Building ID of the resource.
+            resource_id (str): ID of the resource.
+            robot_id (str): Robot which locked the resource, for grants.
+            locked_time (int): Time the resource was locked, for grants.
+            expiration_time (int): Expiration time of the lock, for grants.
+        """
+        with self._lock:
+            conn.commit()
+            if self._segment is None:
+                return
+            self.seq += 1
+            record = {
+                'seq': self.seq,
+                'time': int(time.time() * 1000),
+                'event': event.value,
+                'bldg_id': bldg_id,
+                'resource_id': resource_id,
+                'robot_id': robot_id,
+                'locked_time': locked_time,
+                'expiration_time': expiration_time,
+            }
+            self._segment.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self._segment.flush()
+            if Config.CHANGE_LOG_FSYNC:
+                os.fsync(self._segment.fileno())
+            self._apply(record)
+            self._records_since_snapshot += 1
+
+    def maybe_snapshot(self) -> None:
+        """Write a snapshot if enough records have been appended since the last one."""
+        if self._segment is None or self._records_since_snapshot < Config.CHANGE_LOG_SNAPSHOT_RECORDS:
+            return
+        with self._lock:
+            if self._segment is not None:
+                self._write_snapshot()
+
+    def _try_lock(self) -> bool:
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def _apply(self, record: dict) -> None:
+        key = (record['bldg_id'], record['resource_id'])
+        if record['event'] == ChangeEvent.GRANT.value:
+            self.locks[key] = (record['robot_id'], record['locked_time'], record['expiration_time'])
+        else:
+            self.locks.pop(key, None)
+
+    def _segments(self) -> list[str]:
+        return sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+
+    def _load_snapshot(self) -> None:
+        path = os.path.join(self.directory, SNAPSHOT_NAME)
+        try:
+            with open(path, 'r') as file:
+                snapshot = json.load(file)
+        except FileNotFoundError:
+            snapshot = {'seq': 0, 'locks': []}
+        self.seq = snapshot['seq']
+        self.locks = {
+            (lock['bldg_id'], lock['resource_id']): (lock['robot_id'], lock['locked_time'], lock['expiration_time'])
+            for lock in snapshot['locks']}
+        self._read_segment = None
+        self._read_offset = 0
+
+    def _tail(self) -> None:
+        """Apply the records written after the current read position."""
+        segments = self._segments()
+        if self._read_segment is not None and self._read_segment not in segments:
+            # The segment has been compacted away before we finished it.
+            self._load_snapshot()
+        first = segment_name(self.seq + 1)
+        if self._read_segment is None:
+            # Start from the last segment which may hold records following the snapshot.
+            candidates = [name for name in segments if name <= first]
+            self._read_segment = candidates[-1] if candidates else (segments[0] if segments else None)
+            self._read_offset = 0
+        while self._read_segment is not None:
+            self._read_from(self._read_segment)
+            newer = [name for name in segments if name > self._read_segment]
+            if not newer:
+                break
+            # The owner closes a segment before starting the next one, so read it once more.
+            self._read_from(self._read_segment)
+            self._read_segment = newer[0]
+            self._read_offset = 0
+
+    def _read_from(self, name: str) -> None:
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as file:
+                file.seek(self._read_offset)
+                data = file.read()
+        except FileNotFoundError:
+            return
+        # Leave a partially written last line for the next read.
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.error('Skipping corrupted change log record in %s.', name)
+                continue
+            if record['seq'] > self.seq:
+                self.seq = record['seq']
+                self._apply(record)
+        self._read_offset += end
+
+    def _write_snapshot(self) -> None:
+        """Write a snapshot, start a new segment and remove segments no longer needed.
+
+        Must be called with `_lock` held.
+        """
+        if self._segment is not None:
+            self._segment.close()
+        new_segment = segment_name(self.seq + 1)
+        segment_path = os.path.join(self.directory, new_segment)
+        self._segment = open(segment_path, 'a')
+        if self._segment.tell() > 0:
+            # Terminate a torn record left by a crashed owner so that ours start on a new line.
+            with open(segment_path, 'rb') as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b'\n':
+                    self._segment.write('\n')
+        snapshot = {
+            'seq': self.seq,
+            'time': int(time.time() * 1000),
+            'locks': [
+                {'bldg_id': bldg_id, 'resource_id': resource_id, 'robot_id': robot_id,
+                 'locked_time': locked_time, 'expiration_time': expiration_time}
+                for (bldg_id, resource_id), (robot_id, locked_time, expiration_time) in self.locks.items()],
+        }
+        path = os.path.join(self.directory, SNAPSHOT_NAME)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(snapshot, file, separators=(',', ':'))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + '.tmp', path)
+        self._records_since_snapshot = 0
+        self._read_segment = new_segment
+        self._read_offset = 0
+        # Keep the segment preceding the snapshot for standbys which have not finished it yet.
+        older = [name for name in self._segments() if name < new_segment]
+        for name in older[:-1]:
+            os.remove(os.path.join(self.directory, name))
+
+
+change_log = ChangeLog(Config.CHANGE_LOG_DIR)
@@ -16,9 +16,62 @@
 import os
 
 
+def _rate_limit(name: str, default: str) -> tuple[float, float]:
+    """Read a rate limit given as "<tokens per second>,<burst>" from an environment variable.
+
+    Args:
+        name (str): Name of the environment variable.
+        default (str): Value used when the variable is not set.
+
+    Returns:
+        tuple[float, float]: Refill rate and burst size. A rate of 0 disables the limit.
+    """
+    rate, burst = os.environ.get(name, default).split(',')
+    return float(rate), float(burst)
+
+
 class Config:
     """Configuration for the resource management server database."""
     BASE_DIR = os.path.expanduser('~/.resource_management_server')
     os.makedirs(BASE_DIR, exist_ok=True)
     RESOURCE_DB_NAME = 'resource_database.db'
     RESOURCE_DB_PATH = os.path.join(BASE_DIR, RESOURCE_DB_NAME)
+    # Logging pipeline.
+    LOG_LEVEL = os.environ.get('RESOURCE_LOG_LEVEL', 'INFO').upper()
+    LOG_QUEUE_SIZE = int(os.environ.get('RESOURCE_LOG_QUEUE_SIZE', '10000'))
+    # Max records per second for each log category (0 disables rate limiting) and burst size.
+    LOG_RATE_LIMIT = float(os.environ.get('RESOURCE_LOG_RATE_LIMIT', '20'))
+    LOG_RATE_BURST = int(os.environ.get('RESOURCE_LOG_RATE_BURST', '50'))
+    # Admission control, checked before the request is validated.
+    ADMISSION_ENABLED = os.environ.get('RESOURCE_ADMISSION_ENABLED', '1') != '0'
+    ADMISSION_ROBOT_LIMIT = _rate_limit('RESOURCE_ADMISSION_ROBOT_LIMIT', '20,40')
+    ADMISSION_FLEET_LIMIT = _rate_limit('RESOURCE_ADMISSION_FLEET_LIMIT', '100,200')
+    ADMISSION_ENDPOINT_LIMIT = _rate_limit('RESOURCE_ADMISSION_ENDPOINT_LIMIT', '300,600')
+    ADMISSION_GLOBAL_LIMIT = _rate_limit('RESOURCE_ADMISSION_GLOBAL_LIMIT', '500,1000')
+    # Share of the global burst which status polls may not use.
+    ADMISSION_LOW_PRIORITY_RESERVE = float(os.environ.get('RESOURCE_ADMISSION_LOW_PRIORITY_RESERVE', '0.2'))
+    # The fleet of a robot is the part of its ID matched by this pattern.
+    ADMISSION_FLEET_PATTERN = os.environ.get('RESOURCE_ADMISSION_FLEET_PATTERN', r'[A-Za-z]+')
+    ADMISSION_MAX_BUCKETS = int(os.environ.get('RESOURCE_ADMISSION_MAX_BUCKETS', '10000'))
+    # Change log of lock state, used to recover active locks on restart and by standby servers.
+    CHANGE_LOG_ENABLED = os.environ.get('RESOURCE_CHANGE_LOG_ENABLED', '1') != '0'
+    CHANGE_LOG_DIR = os.environ.get('RESOURCE_CHANGE_LOG_DIR', os.path.join(BASE_DIR, 'changelog'))
+    CHANGE_LOG_FSYNC = os.environ.get('RESOURCE_CHANGE_LOG_FSYNC', '0') != '0'
+    CHANGE_LOG_SNAPSHOT_RECORDS = int(os.environ.get('RESOURCE_CHANGE_LOG_SNAPSHOT_RECORDS', '1000'))
+    CHANGE_LOG_POLL_INTERVAL = float(os.environ.get('RESOURCE_CHANGE_LOG_POLL_INTERVAL', '0.1'))
+    # Wait for the running server to exit instead of starting without the change log.
+    STANDBY = os.environ.get('RESOURCE_STANDBY', '0') != '0'
+    # Max lifetime of a cached resource status (0 for none), which bounds how long a change made by
+    # another process sharing the database can go unnoticed. The change log already keeps a second
+    # server from starting, so a limit is only set by default without it.
+    STATUS_CACHE_TTL_MS = int(os.environ.get(
+        'RESOURCE_STATUS_CACHE_TTL_MS', '0' if CHANGE_LOG_ENABLED else '500'))
+    # Profiling. Requests slower than SLOW_REQUEST_MS are logged with their phases (0 disables the timing).
+    SLOW_REQUEST_MS = float(os.environ.get('RESOURCE_SLOW_REQUEST_MS', '200'))
+    SLOW_SWEEP_MS = float(os.environ.get('RESOURCE_SLOW_SWEEP_MS', '500'))
+    PROFILE_API_ENABLED = os.environ.get('RESOURCE_PROFILE_API_ENABLED', '1') != '0'
+    PROFILE_MAX_SECONDS = float(os.environ.get('RESOURCE_PROFILE_MAX_SECONDS', '60'))
+    PROFILE_INTERVAL = float(os.environ.get('RESOURCE_PROFILE_INTERVAL', '0.005'))
+    # Signal starting a profile written to BASE_DIR (empty disables it).
+    PROFILE_SIGNAL = os.environ.get('RESOURCE_PROFILE_SIGNAL', 'SIGUSR2')
+    PROFILE_SIGNAL_SECONDS = float(os.environ.get('RESOURCE_PROFILE_SIGNAL_SECONDS', '10'))
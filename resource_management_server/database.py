@@ -22,8 +22,15 @@ import time
 import yaml
 from pydantic import ValidationError
 
+from .cache import status_cache
+from .changelog import ChangeEvent
+from .changelog import change_log
 from .config import Config
+from .logger import logger
 from .models import ResourceData
+from .profiling import CONNECTION_FACTORY
+from .profiling import phase
+from .profiling import record_sweep
 
 
 def create_table(c: sqlite3.Cursor) -> None:
@@ -66,7 +73,9 @@ def load_resources_from_yaml(yaml_path: str) -> list[ResourceData]:
             validated_resource = ResourceData(**resource)
             validated_resources.append(validated_resource)
         except ValidationError as err:
-            print(f"Validation error for resource {resource.get('resource_id', 'unknown')}: {err}")
+            logger.error(
+                'Validation error for resource %s: %s', resource.get('resource_id', 'unknown'), err,
+                extra={'category': 'config', 'resource_id': resource.get('resource_id')})
             return []
     return validated_resources
 
@@ -97,7 +106,8 @@ def connect_db() -> sqlite3.Connection:
     Returns:
         sqlite3.Connection: Connection object to the SQLite database.
     """
-    conn = sqlite3.connect(Config.RESOURCE_DB_PATH)
+    with phase('connect_db'):
+        conn = sqlite3.connect(Config.RESOURCE_DB_PATH, factory=CONNECTION_FACTORY)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -106,19 +116,33 @@ def initialize_db() -> None:
     """Initialize the database and create a table using the given YAML config."""
     yaml_path = os.environ.get('RESOURCE_YAML_PATH')
     if not yaml_path:
-        print('RESOURCE_YAML_PATH environment variable is not set.')
+        logger.critical('RESOURCE_YAML_PATH environment variable is not set.')
         sys.exit(1)
     with connect_db() as conn:
         c = conn.cursor()
         create_table(c)
         resources = load_resources_from_yaml(yaml_path)
         if not resources:
-            print('Failed to load resources from YAML.')
+            logger.critical('Failed to load resources from YAML.')
             conn.close()
             sys.exit(1)
         insert_resources(c, resources)
         conn.commit()
-        print(f'Database and table created successfully with data from {yaml_path}.')
+        logger.info('Database and table created successfully with data from %s.', yaml_path)
+
+
+def restore_locks() -> None:
+    """Restore the active locks recovered from the change log to the database."""
+    if not change_log.locks:
+        return
+    with connect_db() as conn:
+        c = conn.cursor()
+        for (bldg_id, resource_id), (robot_id, locked_time, expiration_time) in change_log.locks.items():
+            c.execute('''
+                UPDATE resource_operator SET locked_by = ?, locked_time = ?, expiration_time = ?
+                WHERE bldg_id = ? AND resource_id = ?
+            ''', (robot_id, locked_time, expiration_time, bldg_id, resource_id))
+        conn.commit()
 
 
 def current_timestamp() -> int:
@@ -170,6 +194,7 @@ def get_expiration_time(
 def check_for_timeout() -> None:
     """Periodically checks for resources that have exceeded their max timeout and releases them."""
     while True:
+        sweep_start = time.perf_counter()
         current_time = current_timestamp()
         try:
             with connect_db() as conn:
@@ -188,10 +213,17 @@ def check_for_timeout() -> None:
                         SET locked_by = ?, locked_time = 0, expiration_time = 0
                         WHERE bldg_id = ? AND resource_id = ?
                     ''', ("", row['bldg_id'], row['resource_id']))
-                    conn.commit()
-                    print(f"Released resource {row['resource_id']} in building {row['bldg_id']} due to timeout.")
+                    change_log.commit(conn, ChangeEvent.EXPIRE, row['bldg_id'], row['resource_id'])
+                    status_cache.invalidate(row['bldg_id'], row['resource_id'])
+                    logger.info(
+                        'Released resource %s in building %s due to timeout.', row['resource_id'], row['bldg_id'],
+                        extra={
+                            'category': 'timeout', 'robot_id': row['locked_by'],
+                            'bldg_id': row['bldg_id'], 'resource_id': row['resource_id']})
         except sqlite3.Error as err:
-            print(f"SQLite error during timeout check: {err}")
+            logger.error('SQLite error during timeout check: %s', err, extra={'category': 'sqlite'})
+        change_log.maybe_snapshot()
+        record_sweep(time.perf_counter() - sweep_start)
         time.sleep(1)
 
 
@@ -0,0 +1,223 @@
+# Copyright (c) 2024 SoftBank Corp.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Non-blocking structured logging for the resource management server.
+
+Request threads only put records on a bounded queue. Formatting and writing happen on a
+background listener thread, so a slow stdout never stalls a request.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+
+from .config import Config
+
+LOGGER_NAME = 'resource_management_server'
+# Fields attached to records through `extra` so logs can be joined with metrics.
+CONTEXT_FIELDS = ('category', 'request_id', 'robot_id', 'bldg_id', 'resource_id')
+
+logger = logging.getLogger(LOGGER_NAME)
+
+_listener: '_BlockingStopQueueListener | None' = None
+_queue_handler: 'DroppingQueueHandler | None' = None
+_rate_limit_filter: 'RateLimitFilter | None' = None
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler which drops records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self._lock = threading.Lock()
+        self._pending_drops = 0
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Pass the record through untouched so that formatting happens on the listener thread.
+
+        Args:
+            record (logging.LogRecord): The record to enqueue.
+
+        Returns:
+            logging.LogRecord: The same record.
+        """
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Enqueue a record without blocking, counting it as dropped if the queue is full.
+
+        Args:
+            record (logging.LogRecord): The record to enqueue.
+        """
+        with self._lock:
+            if self._pending_drops:
+                # Report how many records were lost just before this one.
+                record.dropped = self._pending_drops
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self._pending_drops += 1
+                self.dropped += 1
+                return
+            self._pending_drops = 0
+
+
+class _BlockingStopQueueListener(QueueListener):
+    """Queue listener which waits for room in a full queue to enqueue its stop sentinel."""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket rate limiter applied per log category.
+
+    The category is taken from the `category` field of the record, or the logger name if unset.
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._buckets: dict[str, list[float]] = {}
+        self._pending_suppressed: dict[str, int] = {}
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Check whether the record is within the rate limit of its category.
+
+        Args:
+            record (logging.LogRecord): The record to check.
+
+        Returns:
+            bool: True when the record should be emitted.
+        """
+        if self.rate <= 0:
+            return True
+        category = getattr(record, 'category', None) or record.name
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.setdefault(category, [float(self.burst), now])
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                self._pending_suppressed[category] = self._pending_suppressed.get(category, 0) + 1
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1.0
+            # Report how many records of the category were suppressed just before this one.
+            suppressed = self._pending_suppressed.pop(category, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single line JSON objects."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Format the given record.
+
+        Args:
+            record (logging.LogRecord): The record to format.
+
+        Returns:
+            str: JSON representation of the record.
+        """
+        data = {
+            'time': int(record.created * 1000),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS + ('duration_ms', 'phases', 'suppressed', 'dropped'):
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def log_context(category: str, payload: dict | None = None) -> dict[str, str | None]:
+    """Build the `extra` mapping for a log record from a request payload.
+
+    Args:
+        category (str): Category of the record, used for rate limiting.
+        payload (dict | None): Raw request payload to take the context fields from.
+
+    Returns:
+        dict[str, str | None]: Mapping to pass as `extra` to the logger.
+    """
+    payload = payload or {}
+    return {
+        'category': category,
+        'request_id': payload.get('request_id'),
+        'robot_id': payload.get('robot_id'),
+        'bldg_id': payload.get('bldg_id'),
+        'resource_id': payload.get('resource_id'),
+    }
+
+
+def setup_logging() -> logging.Logger:
+    """Attach the queue handler to the package logger and start the listener thread.
+
+    Calling this more than once has no further effect.
+
+    Returns:
+        logging.Logger: The package logger.
+    """
+    global _listener, _queue_handler, _rate_limit_filter
+    if _queue_handler is not None:
+        return logger
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=Config.LOG_QUEUE_SIZE))
+    _rate_limit_filter = RateLimitFilter(Config.LOG_RATE_LIMIT, Config.LOG_RATE_BURST)
+    _queue_handler.addFilter(_rate_limit_filter)
+    logger.addHandler(_queue_handler)
+    logger.setLevel(Config.LOG_LEVEL)
+    logger.propagate = False
+    _listener = _BlockingStopQueueListener(_queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return logger
+
+
+def shutdown_logging() -> None:
+    """Flush the remaining records and stop the listener thread."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+
+
+def get_logging_stats() -> dict[str, int]:
+    """Get counters of the logging pipeline.
+
+    Returns:
+        dict[str, int]: Total numbers of dropped and suppressed records.
+    """
+    return {
+        'dropped': _queue_handler.dropped if _queue_handler else 0,
+        'suppressed': _rate_limit_filter.suppressed if _rate_limit_filter else 0,
+    }
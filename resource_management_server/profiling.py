@@ -0,0 +1,285 @@
+# Copyright (c) 2024 SoftBank Corp.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Profiling hooks for the resource management server.
+
+- Stack sampling on demand, through the profile API or a signal, in the folded format read by
+  flamegraph tools.
+- Per phase timing of each request, logged when the request is slower than a threshold.
+- Duration of each expiry sweep.
+
+When slow request logging is disabled, `phase` returns a shared no-op context manager and
+database connections are not instrumented.
+"""
+
+import contextlib
+import math
+import os
+import signal
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from flask import Flask
+from flask import Response
+from flask import jsonify
+from flask import request
+
+from .config import Config
+from .logger import log_context
+from .logger import logger
+
+_NULL_PHASE = contextlib.nullcontext()
+_profile_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {
+    'slow_requests': 0,
+    'sweeps': 0,
+    'last_sweep_ms': 0.0,
+    'max_sweep_ms': 0.0,
+    'total_sweep_ms': 0.0,
+}
+
+
+class RequestTimer:
+    """Accumulated time per phase of the request being handled."""
+
+    __slots__ = ('start', 'phases')
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.phases: dict[str, float] = {}
+
+
+class _Phase:
+    """Context manager adding its elapsed time to a phase of a request timer."""
+
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer: RequestTimer, name: str) -> None:
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info: object) -> None:
+        phases = self.timer.phases
+        phases[self.name] = phases.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+_current_timer: ContextVar[RequestTimer | None] = ContextVar('request_timer', default=None)
+
+
+def phase(name: str) -> contextlib.AbstractContextManager:
+    """Time a phase of the current request.
+
+    Args:
+        name (str): Name of the phase.
+
+    Returns:
+        contextlib.AbstractContextManager: Context manager measuring the phase, or a no-op one
+            outside of a timed request.
+    """
+    timer = _current_timer.get()
+    if timer is None:
+        return _NULL_PHASE
+    return _Phase(timer, name)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor accounting statement execution to the `sql` phase."""
+
+    def execute(self, *args: object) -> 'TimedCursor':
+        with phase('sql'):
+            return super().execute(*args)
+
+    def fetchone(self) -> sqlite3.Row | None:
+        with phase('sql'):
+            return super().fetchone()
+
+    def fetchall(self) -> list[sqlite3.Row]:
+        with phase('sql'):
+            return super().fetchall()
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection creating timed cursors and accounting commits to the `commit` phase."""
+
+    def cursor(self, factory: type[sqlite3.Cursor] = TimedCursor) -> sqlite3.Cursor:
+        return super().cursor(factory)
+
+    def commit(self) -> None:
+        with phase('commit'):
+            super().commit()
+
+
+# Connection class used by `connect_db`.
+CONNECTION_FACTORY = TimedConnection if Config.SLOW_REQUEST_MS > 0 else sqlite3.Connection
+
+
+def sample_stacks(seconds: float, interval: float) -> str | None:
+    """Sample the stacks of all threads for a time window.
+
+    The profile is wall clock based, so idle threads appear in their waiting functions.
+
+    Args:
+        seconds (float): Length of the window.
+        interval (float): Seconds between samples.
+
+    Returns:
+        str | None: Folded stacks, one "thread;outer;...;inner count" line per distinct stack.
+            None when another profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        own = threading.get_ident()
+        counts: Counter[str] = Counter()
+        now = time.monotonic()
+        deadline = now + seconds
+        while now < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                counts[';'.join(reversed(stack))] += 1
+            # Never sleep past the end of the window.
+            time.sleep(max(min(interval, deadline - time.monotonic()), 0.0))
+            now = time.monotonic()
+    finally:
+        _profile_lock.release()
+    return ''.join(f'{stack} {count}\n' for stack, count in counts.most_common())
+
+
+def _profile_to_file() -> None:
+    profile = sample_stacks(Config.PROFILE_SIGNAL_SECONDS, Config.PROFILE_INTERVAL)
+    if profile is None:
+        logger.warning('Profile requested by signal skipped, another profile is running.')
+        return
+    path = os.path.join(Config.BASE_DIR, f'profile-{int(time.time() * 1000)}.folded')
+    with open(path, 'w') as file:
+        file.write(profile)
+    logger.info('Profile written to %s.', path)
+
+
+def _on_profile_signal(signum: int, frame: object) -> None:
+    # Only start a thread here, the handler interrupts arbitrary code of the main thread.
+    threading.Thread(target=_profile_to_file, name='profiler', daemon=True).start()
+
+
+def record_sweep(seconds: float) -> None:
+    """Record the duration of an expiry sweep.
+
+    Args:
+        seconds (float): Duration of the sweep.
+    """
+    elapsed_ms = seconds * 1000
+    with _stats_lock:
+        _stats['sweeps'] += 1
+        _stats['last_sweep_ms'] = elapsed_ms
+        _stats['max_sweep_ms'] = max(_stats['max_sweep_ms'], elapsed_ms)
+        _stats['total_sweep_ms'] += elapsed_ms
+    if elapsed_ms >= Config.SLOW_SWEEP_MS:
+        logger.warning(
+            'Slow expiry sweep took %.1f ms.', elapsed_ms,
+            extra={'category': 'slow_sweep', 'duration_ms': round(elapsed_ms, 3)})
+
+
+def get_profiling_stats() -> dict[str, int | float]:
+    """Get counters of slow requests and expiry sweeps.
+
+    Returns:
+        dict[str, int | float]: Number of slow requests and statistics of sweep durations.
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def register_profiling(app: Flask) -> None:
+    """Register the profile API, the request timing hooks and the profiling signal handler.
+
+    Must be called before other `before_request` hooks are registered, so that their time is
+    included in the request timing.
+
+    Args:
+        app (Flask): The Flask application.
+    """
+    if Config.PROFILE_SIGNAL:
+        try:
+            signal.signal(getattr(signal, Config.PROFILE_SIGNAL), _on_profile_signal)
+        except (AttributeError, ValueError) as err:
+            logger.warning('Cannot install profiling signal handler for %s: %s', Config.PROFILE_SIGNAL, err)
+
+    if Config.PROFILE_API_ENABLED:
+        @app.route('/api/profile', methods=['GET'])
+        def get_profile() -> Response:
+            """Sample the stacks of all threads for a time window.
+
+            THIS API IS FOR DEBUG PURPOSES ONLY.
+
+            Query parameters `seconds` and `interval` set the window and the sampling interval.
+
+            Returns:
+                Response: Folded stacks readable by flamegraph tools.
+            """
+            seconds = request.args.get('seconds', 5.0, type=float)
+            interval = request.args.get('interval', Config.PROFILE_INTERVAL, type=float)
+            if not (math.isfinite(seconds) and math.isfinite(interval)):
+                return jsonify({'error': '`seconds` and `interval` must be finite numbers.'}), 400
+            seconds = max(min(seconds, Config.PROFILE_MAX_SECONDS), 0.0)
+            interval = max(min(interval, seconds, Config.PROFILE_MAX_SECONDS), 0.001)
+            profile = sample_stacks(seconds, interval)
+            if profile is None:
+                return jsonify({'error': 'Another profile is running.'}), 409
+            return Response(profile, mimetype='text/plain')
+
+    if Config.SLOW_REQUEST_MS <= 0:
+        return
+
+    @app.before_request
+    def start_request_timer() -> None:
+        """Start timing the request and parse its JSON body."""
+        timer = RequestTimer()
+        _current_timer.set(timer)
+        if request.method == 'POST':
+            with _Phase(timer, 'json_parse'):
+                request.get_json(silent=True)
+
+    @app.teardown_request
+    def finish_request_timer(exc: BaseException | None) -> None:
+        """Log the phases of the request if it was slow."""
+        timer = _current_timer.get()
+        if timer is None:
+            return
+        _current_timer.set(None)
+        elapsed_ms = (time.perf_counter() - timer.start) * 1000
+        # Profiling requests are slow by design.
+        if elapsed_ms < Config.SLOW_REQUEST_MS or request.endpoint == 'get_profile':
+            return
+        with _stats_lock:
+            _stats['slow_requests'] += 1
+        payload = request.get_json(silent=True) if request.method == 'POST' else None
+        extra = log_context('slow_request', payload if isinstance(payload, dict) else None)
+        extra['duration_ms'] = round(elapsed_ms, 3)
+        extra['phases'] = {name: round(seconds * 1000, 3) for name, seconds in timer.phases.items()}
+        logger.warning('Slow request %s %s took %.1f ms.', request.method, request.path, elapsed_ms, extra=extra)
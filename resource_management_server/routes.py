@@ -21,10 +21,17 @@ from flask import jsonify
 from flask import request
 from pydantic import ValidationError
 
+from .cache import render_status
+from .cache import status_cache
+from .changelog import ChangeEvent
+from .changelog import change_log
 from .database import connect_db
 from .database import current_timestamp
 from .database import get_expiration_time
 from .database import get_max_expiration_time
+from .logger import get_logging_stats
+from .logger import log_context
+from .logger import logger
 from .models import RegistrationPayload
 from .models import RegistrationResultPayload
 from .models import ReleasePayload
@@ -37,6 +44,8 @@ from .models import ResultId
 from .models import RobotState
 from .models import RobotStatusPayload
 from .models import RobotStatusResultPayload
+from .profiling import get_profiling_stats
+from .profiling import phase
 
 
 def register_routes(app: Flask) -> None:
@@ -62,6 +71,25 @@ def register_routes(app: Flask) -> None:
         except ValidationError as err:
             return jsonify({'error': f'Data validation error: {str(err)}'}), 500
 
+    @app.route('/api/metrics', methods=['GET'])
+    def get_metrics() -> Response:
+        """Get counters of the server internals.
+
+        THIS API IS FOR DEBUG PURPOSES ONLY.
+
+        Returns:
+            Response: JSON response containing the counters.
+        """
+        metrics = {
+            'status_cache': status_cache.stats(),
+            'logging': get_logging_stats(),
+            'profiling': get_profiling_stats(),
+        }
+        admission_control = app.extensions.get('admission_control')
+        if admission_control is not None:
+            metrics['admission'] = admission_control.stats()
+        return jsonify(metrics)
+
     @app.route('/api/registration', methods=['POST'])
     def registration_call() -> Response:
         """Register a robot to a resource.
@@ -70,9 +98,10 @@ def register_routes(app: Flask) -> None:
             Response: JSON response containing the result of the registration request.
         """
         try:
-            request_data = RegistrationPayload(**request.json)
+            with phase('validation'):
+                request_data = RegistrationPayload(**request.json)
         except ValidationError as err:
-            print(f'Validation error:\n{err}')
+            logger.warning('Validation error:\n%s', err, extra=log_context('validation', request.json))
             error_response = RegistrationResultPayload(
                 result=ResultId.OTHERS,
                 max_expiration_time=0,
@@ -101,7 +130,9 @@ def register_routes(app: Flask) -> None:
                     expiration_time = get_expiration_time(
                         request_data.timestamp, row['default_timeout'], row['max_timeout'], request_data.timeout)
                     if not expiration_time:
-                        print('Requested timeout or timestamp is invalid.')
+                        logger.warning(
+                            'Requested timeout or timestamp is invalid.',
+                            extra=log_context('registration', request.json))
                         return_data.result = ResultId.OTHERS
                     else:
                         c.execute('''
@@ -113,11 +144,15 @@ def register_routes(app: Flask) -> None:
                         return_data.max_expiration_time = get_max_expiration_time(
                             request_data.timestamp, row['max_timeout'])
                         return_data.expiration_time = expiration_time
-                        conn.commit()
+                        change_log.commit(
+                            conn, ChangeEvent.GRANT, request_data.bldg_id, request_data.resource_id,
+                            request_data.robot_id, request_data.timestamp, expiration_time)
+                        status_cache.invalidate(request_data.bldg_id, request_data.resource_id)
         except sqlite3.Error as err:
-            print(f'SQLite error:\n{err}')
+            logger.error('SQLite error:\n%s', err, extra=log_context('sqlite', request.json))
             return_data.result = ResultId.OTHERS
-        return jsonify(return_data.model_dump())
+        with phase('serialization'):
+            return jsonify(return_data.model_dump())
 
     @app.route('/api/release', methods=['POST'])
     def release_call() -> Response:
@@ -127,9 +162,10 @@ def register_routes(app: Flask) -> None:
             Response: JSON response containing the result of the release request.
         """
         try:
-            received_data = ReleasePayload(**request.json)
+            with phase('validation'):
+                received_data = ReleasePayload(**request.json)
         except ValidationError as err:
-            print(f'Validation error:\n{err}')
+            logger.warning('Validation error:\n%s', err, extra=log_context('validation', request.json))
             error_response = ReleaseResultPayload(
                 result=ResultId.OTHERS,
                 resource_id=request.json.get("resource_id", ""),
@@ -156,13 +192,15 @@ def register_routes(app: Flask) -> None:
                         WHERE bldg_id = ? AND resource_id = ?
                     ''', ("", received_data.bldg_id, received_data.resource_id))
 
-                    conn.commit()
+                    change_log.commit(conn, ChangeEvent.RELEASE, received_data.bldg_id, received_data.resource_id)
+                    status_cache.invalidate(received_data.bldg_id, received_data.resource_id)
                 else:
                     return_data.result = ResultId.FAILURE
         except sqlite3.Error as err:
-            print(f'SQLite error:\n{err}')
+            logger.error('SQLite error:\n%s', err, extra=log_context('sqlite', request.json))
             return_data.result = ResultId.OTHERS
-        return jsonify(return_data.model_dump())
+        with phase('serialization'):
+            return jsonify(return_data.model_dump())
 
     @app.route('/api/request_resource_status', methods=['POST'])
     def request_resource_status() -> Response:
@@ -172,7 +210,8 @@ def register_routes(app: Flask) -> None:
             Response: JSON response containing the status of the requested resource.
         """
         try:
-            received_data = RequestResourceStatusPayload(**request.json)
+            with phase('validation'):
+                received_data = RequestResourceStatusPayload(**request.json)
         except ValidationError as err:
             error_response = ResourceStatusPayload(
                 result=ResultId.OTHERS,
@@ -180,8 +219,15 @@ def register_routes(app: Flask) -> None:
                 resource_state=ResourceState.UNKNOWN,
                 request_id=request.json.get("request_id", ""),
                 timestamp=current_timestamp())
-            print(f'Validation error:\n{err}')
+            logger.warning('Validation error:\n%s', err, extra=log_context('validation', request.json))
             return jsonify(error_response.model_dump()), 400
+        now = current_timestamp()
+        body = status_cache.get(received_data.bldg_id, received_data.resource_id, now)
+        if body is not None:
+            with phase('serialization'):
+                return Response(
+                    render_status(body, received_data.request_id, now), mimetype='application/json')
+        version = status_cache.version(received_data.bldg_id, received_data.resource_id)
         return_data = ResourceStatusPayload(
             result=ResultId.SUCCESS,
             robot_id="",
@@ -190,7 +236,7 @@ def register_routes(app: Flask) -> None:
             resource_id=received_data.resource_id,
             resource_state=ResourceState.UNKNOWN,
             request_id=received_data.request_id,
-            timestamp=current_timestamp())
+            timestamp=now)
         try:
             with connect_db() as conn:
                 c = conn.cursor()
@@ -209,9 +255,16 @@ def register_routes(app: Flask) -> None:
                 else:
                     return_data.result = ResultId.FAILURE
         except sqlite3.Error as err:
-            print(f'SQLite error:\n{err}')
+            logger.error('SQLite error:\n%s', err, extra=log_context('sqlite', request.json))
             return_data.result = ResultId.OTHERS
-        return jsonify(return_data.model_dump())
+        with phase('serialization'):
+            if return_data.result != ResultId.SUCCESS:
+                return jsonify(return_data.model_dump())
+            # Only statuses of existing resources are cached, so unknown IDs cannot grow the cache.
+            body = status_cache.put(
+                received_data.bldg_id, received_data.resource_id, return_data,
+                return_data.expiration_time or None, version, now)
+            return Response(render_status(body, received_data.request_id, now), mimetype='application/json')
 
     @app.route('/api/robot_status', methods=['POST'])
     def robot_status() -> Response:
@@ -221,13 +274,14 @@ def register_routes(app: Flask) -> None:
             Response: JSON response containing the result of the robot status update.
         """
         try:
-            received_data = RobotStatusPayload(**request.json)
+            with phase('validation'):
+                received_data = RobotStatusPayload(**request.json)
         except ValidationError as err:
             error_response = RobotStatusResultPayload(
                 result=ResultId.OTHERS,
                 request_id=request.json.get("request_id", ""),
                 timestamp=current_timestamp())
-            print(f'Validation error:\n{err}')
+            logger.warning('Validation error:\n%s', err, extra=log_context('validation', request.json))
             return jsonify(error_response.model_dump()), 400
         return_data = RobotStatusResultPayload(
             result=ResultId.SUCCESS,
@@ -237,7 +291,7 @@ def register_routes(app: Flask) -> None:
         try:
             with connect_db() as conn:
                 if received_data.state == RobotState.CANCEL:
-                    print("Robot has canceled the request.")
+                    logger.info('Robot has canceled the request.', extra=log_context('robot_status', request.json))
                     # Find the resource the robot is using and release it.
                     c = conn.cursor()
                     c.execute(
@@ -250,11 +304,13 @@ def register_routes(app: Flask) -> None:
                             SET locked_by = ?
                             WHERE bldg_id = ? AND resource_id = ?
                         ''', ('', row['bldg_id'], row['resource_id']))
-                        conn.commit()
+                        change_log.commit(conn, ChangeEvent.CANCEL, row['bldg_id'], row['resource_id'])
+                        status_cache.invalidate(row['bldg_id'], row['resource_id'])
                     else:
                         return_data.result = ResultId.FAILURE
                 # TODO: Manage other states?
         except sqlite3.Error as err:
-            print(f'SQLite error:\n{err}')
+            logger.error('SQLite error:\n%s', err, extra=log_context('sqlite', request.json))
             return_data.result = ResultId.OTHERS
-        return jsonify(return_data.model_dump())
+        with phase('serialization'):
+            return jsonify(return_data.model_dump())